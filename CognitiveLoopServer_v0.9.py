@@ -1,18 +1,37 @@
 # server.py — Cognitive Loop MCP (Option 2 orchestration)
 
 from fastmcp import FastMCP as Server
-from datetime import datetime
+from datetime import datetime, timezone
+import atexit
 import json
 import os
+import sys
+import threading
+import time
 from typing import List, Dict, Any
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 server = Server("cognitive-loop")
 
 # ---------------------------------------------------------
-# Persistent state (local JSON file)
+# Persistent state (JSON snapshot + append-only delta log)
 # ---------------------------------------------------------
 
 STATE_PATH = os.path.join(os.path.dirname(__file__), "cognitive_loop_state.json")
+LOG_PATH = os.path.join(os.path.dirname(__file__), "cognitive_loop_state.log")
+
+# Bursts of state updates within this window are coalesced into one write
+FLUSH_INTERVAL_MS = 50
+
+# Once the log holds this many deltas it is folded into a fresh snapshot
+SNAPSHOT_EVERY_RECORDS = 256
+
+# The state file is machine-only; pass --pretty to indent it for debugging
+PRETTY_STATE = False
 
 STATE_DEFAULT = {
     "cycle": 0,
@@ -20,41 +39,206 @@ STATE_DEFAULT = {
     "last_plan": [],
     "last_reflection": [],
     "heartbeat": 0,
-    "last_seen": None,
+    "last_seen_ns": None,
 }
 
+# Process-local mirror of the state file; disk is only written through.
+_STATE_CACHE: Dict[str, Any] = {}
+_STATE_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_dirty = threading.Event()
 
-def _load_state_from_disk() -> Dict[str, Any]:
-    if not os.path.exists(STATE_PATH):
-        return dict(STATE_DEFAULT)
+# Deltas waiting for the flusher, and the log they are appended to
+_pending: List[Dict[str, Any]] = []
+_log_file = None
+_log_records = 0
+
+
+def _dumps(obj: Any, pretty: bool = False) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except orjson.JSONEncodeError:
+            # e.g. ints beyond 64 bits from set_state; the stdlib copes
+            pass
+    if pretty:
+        return json.dumps(obj, indent=2).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_persistable(obj: Dict[str, Any], pretty: bool = False) -> bytes:
+    """
+    Like _dumps, but drops (and reports) keys whose values can't be
+    serialized, so one bad entry never blocks the rest from being saved.
+    """
+    try:
+        return _dumps(obj, pretty)
+    except (TypeError, ValueError):
+        pass
+    kept: Dict[str, Any] = {}
+    for key, value in obj.items():
+        try:
+            _dumps({key: value})
+        except (TypeError, ValueError):
+            print(f"cognitive-loop: not persisting unserializable state key {key!r}", file=sys.stderr)
+            continue
+        kept[key] = value
+    return _dumps(kept, pretty)
+
+
+def _loads(raw: bytes) -> Any:
+    # Only runs once at startup (the cache serves every later read), so use
+    # the stdlib: orjson would turn big ints into floats and reject the
+    # NaN/Infinity tokens the json fallback in _dumps can write
+    return json.loads(raw)
+
+
+def _read_log() -> List[Dict[str, Any]]:
+    deltas: List[Dict[str, Any]] = []
+    if not os.path.exists(LOG_PATH):
+        return deltas
     try:
-        with open(STATE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        valid_end = 0
+        with open(LOG_PATH, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated record")
+                    deltas.append(_loads(line))
+                except ValueError:
+                    break
+                valid_end += len(line)
+            torn = f.tell() != valid_end
+        if torn:
+            # Crash mid-append: drop the partial record so new appends
+            # don't get glued onto it
+            os.truncate(LOG_PATH, valid_end)
     except Exception:
-        return dict(STATE_DEFAULT)
+        pass
+    return deltas
+
 
+def _load_state_from_disk() -> Dict[str, Any]:
+    global _log_records
     merged = dict(STATE_DEFAULT)
-    merged.update(data)
+    if os.path.exists(STATE_PATH):
+        try:
+            with open(STATE_PATH, "rb") as f:
+                merged.update(_loads(f.read()))
+        except Exception:
+            pass
+
+    # Replaying is idempotent, so deltas already folded into the snapshot
+    # (crash between snapshot and log truncation) are harmless
+    deltas = _read_log()
+    for delta in deltas:
+        merged.update(delta)
+    _log_records = len(deltas)
     return merged
 
 
-def _save_state_to_disk(state: Dict[str, Any]) -> None:
+def _save_state_to_disk(state: Dict[str, Any]) -> bool:
+    tmp_path = STATE_PATH + ".tmp"
     try:
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
+        # Serialize up front so the file is written with a single write()
+        payload = _dumps_persistable(state, pretty=PRETTY_STATE)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        # Atomic swap so a crash never leaves a half-written state file
+        os.replace(tmp_path, STATE_PATH)
     except Exception:
         # Fail silently; state is best-effort
+        return False
+    return True
+
+
+def _append_to_log(deltas: List[Dict[str, Any]]) -> None:
+    global _log_file, _log_records
+    try:
+        if _log_file is None:
+            _log_file = open(LOG_PATH, "ab", buffering=64 * 1024)
+        # Per delta, so one unserializable value can't sink the whole batch
+        _log_file.write(b"".join(_dumps_persistable(d) + b"\n" for d in deltas))
+        _log_file.flush()
+        _log_records += len(deltas)
+    except Exception:
+        # Fail silently; the next snapshot still captures the cache
         pass
 
 
+def _compact_log(snapshot: Dict[str, Any]) -> None:
+    global _log_records
+    if not _save_state_to_disk(snapshot):
+        # Keep the log; it still holds the only durable copy of the deltas
+        # and the next flush (or exit) retries the snapshot
+        return
+    try:
+        if _log_file is not None:
+            _log_file.truncate(0)
+        elif os.path.exists(LOG_PATH):
+            os.truncate(LOG_PATH, 0)
+        _log_records = 0
+    except Exception:
+        pass
+
+
+def _flush_now(compact: bool = False) -> None:
+    with _FLUSH_LOCK:
+        if not _dirty.is_set() and not (compact and _log_records):
+            return
+        _dirty.clear()
+        # Drain deltas and snapshot together so the snapshot covers
+        # exactly what has been logged
+        with _STATE_LOCK:
+            deltas = list(_pending)
+            _pending.clear()
+            snapshot = dict(_STATE_CACHE)
+        _append_to_log(deltas)
+        if compact or _log_records >= SNAPSHOT_EVERY_RECORDS:
+            _compact_log(snapshot)
+
+
+def _flush_worker() -> None:
+    while True:
+        _dirty.wait()
+        time.sleep(FLUSH_INTERVAL_MS / 1000.0)
+        _flush_now()
+
+
+def _get_state_cache() -> Dict[str, Any]:
+    if not _STATE_CACHE:
+        _STATE_CACHE.update(_load_state_from_disk())
+    return _STATE_CACHE
+
+
 def load_state() -> Dict[str, Any]:
-    return _load_state_from_disk()
+    # Shallow copy so callers can't mutate the cache behind our back
+    with _STATE_LOCK:
+        return dict(_get_state_cache())
+
+
+def _last_seen_iso(last_seen_ns: int) -> str:
+    return datetime.fromtimestamp(last_seen_ns / 1e9, tz=timezone.utc).isoformat()
 
 
 def save_state(updates: Dict[str, Any]) -> None:
-    state = load_state()
-    state.update(updates)
-    _save_state_to_disk(state)
+    """
+    Merge updates into the cached state and queue them as a log delta.
+    The background flusher appends them within FLUSH_INTERVAL_MS.
+    """
+    with _STATE_LOCK:
+        _get_state_cache().update(updates)
+        _pending.append(dict(updates))
+        _dirty.set()
+
+
+threading.Thread(target=_flush_worker, name="state-flusher", daemon=True).start()
+atexit.register(_flush_now, True)
 
 
 # ---------------------------------------------------------
@@ -64,13 +248,13 @@ def save_state(updates: Dict[str, Any]) -> None:
 @server.tool()
 def heartbeat() -> Dict[str, Any]:
     """
-    Increment heartbeat and update last_seen.
+    Increment heartbeat and update last_seen_ns.
     Used to confirm the loop is reachable and alive.
     """
     state = load_state()
     updates = {
         "heartbeat": state.get("heartbeat", 0) + 1,
-        "last_seen": datetime.utcnow().isoformat(),
+        "last_seen_ns": time.time_ns(),
     }
     save_state(updates)
     return {"status": "ok", "state_updates": updates}
@@ -140,7 +324,7 @@ def run_cycle(goal: str = "") -> Dict[str, Any]:
         "cycle": cycle_num,
         "active_goals": [goal] if goal else state.get("active_goals", []),
         "last_plan": plan,
-        "last_seen": datetime.utcnow().isoformat(),
+        "last_seen_ns": time.time_ns(),
     }
 
     save_state(updates)
@@ -173,7 +357,7 @@ def reflect(results: List[Dict[str, Any]]) -> Dict[str, Any]:
 
     updates = {
         "last_reflection": insights,
-        "last_seen": datetime.utcnow().isoformat(),
+        "last_seen_ns": time.time_ns(),
     }
 
     save_state(updates)
@@ -188,8 +372,12 @@ def reflect(results: List[Dict[str, Any]]) -> Dict[str, Any]:
 def get_state() -> Dict[str, Any]:
     """
     Return the current persistent state.
+    The stored epoch timestamp is also rendered as an ISO last_seen.
     """
-    return load_state()
+    state = load_state()
+    if state.get("last_seen_ns") is not None:
+        state["last_seen"] = _last_seen_iso(state["last_seen_ns"])
+    return state
 
 
 @server.tool()
@@ -206,4 +394,5 @@ def set_state(updates: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------
 
 if __name__ == "__main__":
+    PRETTY_STATE = "--pretty" in sys.argv[1:]
     server.run()
@@ -4,8 +4,12 @@ import json
 import traceback
 import math
 import random
+import re
 import io
+import os
+import shutil
 import base64
+import functools
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
@@ -15,6 +19,7 @@ from typing import Any, Dict, List, Optional
 
 SANDBOX_ROOT = Path(__file__).parent / "sandbox"
 SANDBOX_ROOT.mkdir(parents=True, exist_ok=True)
+_SANDBOX_ROOT_RESOLVED = SANDBOX_ROOT.resolve()
 
 # GPU backend flags
 GPU_BACKEND = None
@@ -37,6 +42,18 @@ except ImportError:
     scipy = None
     integrate = None
 
+# Fast JSON for the JSON-RPC channel
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional JIT for the physics helpers
+try:
+    import numba
+except ImportError:
+    numba = None
+
 # Plotting (headless)
 try:
     import matplotlib
@@ -67,27 +84,101 @@ if xp is None:
     xp = np
     GPU_BACKEND = "cpu"
 
+# Below this many elements the host<->device transfer outweighs the win
+GPU_NOISE_MIN_ELEMENTS = 1 << 20
+
 
 # =========================
 # Utility: JSON-RPC I/O
 # =========================
 
+# Bound on first protocol I/O (before any tool runs): run_sandboxed_python
+# swaps sys.stdout/sys.stderr, and protocol traffic must never end up in a
+# captured buffer. Lazy so importing works where stdio has no real fd.
+_IN = None
+_OUT = None
+
+
+def _bind_stdio() -> None:
+    global _IN, _OUT
+    _IN = getattr(sys.stdin, "buffer", sys.stdin)
+    try:
+        _OUT = io.BufferedWriter(io.FileIO(sys.stdout.fileno(), "wb", closefd=False), buffer_size=65536)
+    except (AttributeError, OSError, ValueError):
+        # No usable fd (StringIO, IDLE, capture); use whatever stdout offers
+        _OUT = getattr(sys.stdout, "buffer", sys.stdout)
+
+
+# 20+ digit runs may be ints beyond 64 bits, which orjson decodes as floats
+_BIG_INT_RE = re.compile(rb"\d{20}")
+
+
 def read_message() -> Optional[Dict[str, Any]]:
-    line = sys.stdin.readline()
+    if _IN is None:
+        _bind_stdio()
+    line = _IN.readline()
     if not line:
         return None
+    if isinstance(line, str):
+        line = line.encode("utf-8")
     line = line.strip()
     if not line:
         return None
+    if orjson is not None and not _BIG_INT_RE.search(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # e.g. NaN/Infinity tokens, which the stdlib accepts
+            pass
     try:
         return json.loads(line)
-    except json.JSONDecodeError:
+    except ValueError:
         return None
 
 
+def _json_default(obj: Any) -> Any:
+    # NumPy arrays/scalars that orjson can't serialize natively (and all of
+    # them on the stdlib fallback)
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _nonfinite_to_null(obj: Any) -> Any:
+    # Match orjson on the stdlib path: inf/nan go out as null, not as the
+    # non-standard Infinity/NaN tokens
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _nonfinite_to_null(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_nonfinite_to_null(v) for v in obj]
+    if hasattr(obj, "tolist"):
+        return _nonfinite_to_null(obj.tolist())
+    return obj
+
+
+_ORJSON_OPTS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
 def send_message(msg: Dict[str, Any]) -> None:
-    sys.stdout.write(json.dumps(msg) + "\n")
-    sys.stdout.flush()
+    payload = None
+    if orjson is not None:
+        try:
+            payload = orjson.dumps(msg, default=_json_default, option=_ORJSON_OPTS)
+        except orjson.JSONEncodeError:
+            # e.g. ints beyond 64 bits from run_python; the stdlib copes
+            pass
+    if payload is None:
+        payload = json.dumps(_nonfinite_to_null(msg), default=_json_default).encode("utf-8")
+    if _OUT is None:
+        _bind_stdio()
+    if isinstance(_OUT, io.TextIOBase):
+        _OUT.write(payload.decode("utf-8") + "\n")
+    else:
+        _OUT.write(payload)
+        _OUT.write(b"\n")
+    _OUT.flush()
 
 
 # =========================
@@ -95,28 +186,22 @@ def send_message(msg: Dict[str, Any]) -> None:
 # =========================
 
 def sandbox_path(rel: str) -> Path:
-    rel = rel.replace("..", "")
-    return SANDBOX_ROOT / rel
+    p = (SANDBOX_ROOT / rel).resolve()
+    if not p.is_relative_to(_SANDBOX_ROOT_RESOLVED):
+        raise ValueError(f"path escapes the sandbox: {rel}")
+    return p
 
 
 def reset_sandbox_dir() -> None:
-    if SANDBOX_ROOT.exists():
-        for p in SANDBOX_ROOT.glob("**/*"):
-            if p.is_file():
-                try:
-                    p.unlink()
-                except Exception:
-                    pass
+    shutil.rmtree(SANDBOX_ROOT, ignore_errors=True)
+    SANDBOX_ROOT.mkdir(parents=True, exist_ok=True)
 
 
 # =========================
 # Physics helpers (Kerr-ish, simplified)
 # =========================
 
-def kerr_isco_radius(a: float) -> float:
-    """
-    Approximate ISCO radius (prograde) in units of GM/c^2 for spin a in [0, 1).
-    """
+def _kerr_isco_radius(a: float) -> float:
     z1 = 1 + (1 - a**2) ** (1/3) * ((1 + a) ** (1/3) + (1 - a) ** (1/3))
     z2 = (3 * a**2 + z1**2) ** 0.5
     return 3 + z2 - ((3 - z1) * (3 + z1 + 2 * z2)) ** 0.5
@@ -128,7 +213,7 @@ def gravitational_redshift(r: float, m: float = 1.0) -> float:
     """
     rs = 2 * m
     if r <= rs:
-        return float("inf")
+        return math.inf
     return 1.0 / math.sqrt(1 - rs / r)
 
 
@@ -136,24 +221,129 @@ def sample_orbit_radii(a: float, n: int = 128) -> List[float]:
     """
     Sample radii from ISCO outward for simple orbit visualizations.
     """
+    if np is not None:
+        return _orbit_radii_array(a, n).tolist()
     r_isco = kerr_isco_radius(a)
     return [r_isco + (i / (n - 1)) * (20 - r_isco) for i in range(n)]
 
 
+def _orbit_radii_array(a: float, n: int) -> "np.ndarray":
+    # Non-positive n yields no samples, like the list-comprehension path
+    return np.linspace(kerr_isco_radius(a), 20.0, max(n, 0), dtype=np.float64)
+
+
+def _redshift_array_np(r: "np.ndarray", m: float = 1.0) -> "np.ndarray":
+    """
+    Vectorized gravitational_redshift over an array of radii.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    rs = 2 * m
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = 1.0 / np.sqrt(1.0 - rs / r)
+    return np.where(r <= rs, np.inf, z)
+
+
+redshift_array = _redshift_array_np
+
+if numba is not None:
+    # Signatures are given so compilation happens here at import rather than
+    # on first call inside the sandbox, whose builtins lack __import__.
+    # fastmath minus 'nnan'/'ninf' since the redshift must still yield inf.
+    _FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+    _kerr_isco_scalar = numba.njit(
+        "float64(float64)", cache=True, fastmath=_FASTMATH)(_kerr_isco_radius)
+    _redshift_scalar = numba.njit(
+        "float64(float64, float64)", cache=True, fastmath=_FASTMATH)(gravitational_redshift)
+
+    @numba.njit("float64[::1](float64[::1], float64)", cache=True, parallel=True, fastmath=_FASTMATH)
+    def _redshift_kernel(r, m):
+        out = np.empty_like(r)
+        for i in numba.prange(r.shape[0]):
+            out[i] = _redshift_scalar(r[i], m)
+        return out
+
+    @numba.njit("float64[::1](float64[::1])", cache=True, parallel=True, fastmath=_FASTMATH)
+    def _kerr_isco_kernel(a):
+        out = np.empty_like(a)
+        for i in numba.prange(a.shape[0]):
+            out[i] = _kerr_isco_scalar(a[i])
+        return out
+
+    def _kerr_isco_radius(a):
+        # Same contract as the pure formula: scalars in, scalar out;
+        # arrays of any shape in, array of that shape out
+        if np.ndim(a) == 0:
+            return _kerr_isco_scalar(float(a))
+        a = np.asarray(a, dtype=np.float64)
+        return _kerr_isco_kernel(np.ascontiguousarray(a).ravel()).reshape(a.shape)
+
+    def gravitational_redshift(r: float, m: float = 1.0) -> float:
+        """
+        Very rough Schwarzschild redshift factor at radius r (in units of GM/c^2).
+        """
+        # float() so 0-d arrays and NumPy scalars work as with the pure version
+        return _redshift_scalar(float(r), float(m))
+
+    def redshift_array(r, m: float = 1.0) -> "np.ndarray":
+        """
+        Vectorized gravitational_redshift over an array of radii.
+        """
+        r = np.asarray(r, dtype=np.float64)
+        out = _redshift_kernel(np.ascontiguousarray(r).ravel(), float(m))
+        return out.reshape(r.shape)
+
+
+@functools.lru_cache(maxsize=256)
+def _kerr_isco_radius_cached(a: float) -> float:
+    return _kerr_isco_radius(a)
+
+
+def kerr_isco_radius(a: float) -> float:
+    """
+    Approximate ISCO radius (prograde) in units of GM/c^2 for spin a in [0, 1).
+    Scalar spins are memoized on a rounded to 9 decimals, since the same
+    spins recur; arrays are evaluated element-wise without the cache.
+    """
+    if isinstance(a, (int, float)) or (np is not None and isinstance(a, np.generic)):
+        return _kerr_isco_radius_cached(round(float(a), 9))
+    if np is not None:
+        a = np.asarray(a, dtype=np.float64)
+    return _kerr_isco_radius(a)
+
+
 # =========================
 # Chaos parameter generator
 # =========================
 
-def generate_chaos_parameters() -> Dict[str, Any]:
+_RNG = np.random.default_rng() if np is not None else None
+
+
+def generate_chaos_parameters(seed: Optional[int] = None) -> Dict[str, Any]:
     """
     Generate a chaotic but bounded parameter set for a near-extremal Kerr BH.
+    Pass seed for a reproducible set; random.seed() does not affect it.
     """
-    spin = random.uniform(0.9, 0.9999)
-    turbulence = random.uniform(0.3, 1.5)
-    hotspot_orbits = random.randint(1, 7)
-    lensing_intensity = random.uniform(0.8, 1.4)
-    frame_drag_factor = random.uniform(1.0, 1.5)
-    noise_seed = random.randint(0, 10_000_000)
+    if _RNG is not None:
+        rng = _RNG if seed is None else np.random.default_rng(seed)
+        # One draw for the floats and one for the ints instead of six calls
+        u = rng.random(4)
+        orbits, noise_seed = rng.integers([1, 0], [8, 10_000_001])
+        return {
+            "spin": 0.9 + float(u[0]) * 0.0999,
+            "turbulence": 0.3 + float(u[1]) * 1.2,
+            "hotspot_orbits": int(orbits),
+            "lensing_intensity": 0.8 + float(u[2]) * 0.6,
+            "frame_drag_factor": 1.0 + float(u[3]) * 0.5,
+            "noise_seed": int(noise_seed),
+        }
+
+    rnd = random if seed is None else random.Random(seed)
+    spin = rnd.uniform(0.9, 0.9999)
+    turbulence = rnd.uniform(0.3, 1.5)
+    hotspot_orbits = rnd.randint(1, 7)
+    lensing_intensity = rnd.uniform(0.8, 1.4)
+    frame_drag_factor = rnd.uniform(1.0, 1.5)
+    noise_seed = rnd.randint(0, 10_000_000)
 
     return {
         "spin": spin,
@@ -169,32 +359,78 @@ def generate_chaos_parameters() -> Dict[str, Any]:
 # Noise / field generation
 # =========================
 
-def generate_noise_field(width: int, height: int, seed: Optional[int] = None) -> List[List[float]]:
+def _gpu_noise_array(width: int, height: int, seed: Optional[int]) -> Optional["np.ndarray"]:
+    """
+    Draw the field on the GPU backend, if one is usable.
+    Note that a given seed yields different values than the CPU path.
+    """
+    if GPU_BACKEND == "cupy":
+        # cupy imports fine on hosts without a device/driver; fall back then
+        try:
+            field = cp.random.default_rng(seed).random((height, width), dtype=cp.float32)
+            return cp.asnumpy(field)
+        except Exception:
+            return None
+    if GPU_BACKEND == "torch" and torch.cuda.is_available():
+        # CUDA OOM / driver errors fall back to NumPy as well
+        try:
+            gen = torch.Generator(device="cuda")
+            if seed is not None:
+                gen.manual_seed(seed)
+            else:
+                gen.seed()
+            field = torch.rand((height, width), generator=gen, device="cuda", dtype=torch.float32)
+            return field.cpu().numpy()
+        except Exception:
+            return None
+    return None
+
+
+def _noise_array(width: int, height: int, seed: Optional[int] = None) -> "np.ndarray":
     if np is None:
         raise RuntimeError("NumPy is required for noise generation.")
-    if seed is not None:
-        np.random.seed(seed)
-    field = np.random.rand(height, width).astype("float32")
-    return field.tolist()
+    if width * height >= GPU_NOISE_MIN_ELEMENTS:
+        field = _gpu_noise_array(width, height, seed)
+        if field is not None:
+            return field
+    # Per-call Generator: no shared global RNG state between requests
+    rng = np.random.default_rng(seed)
+    return rng.random((height, width), dtype=np.float32)
+
+
+def generate_noise_field(width: int, height: int, seed: Optional[int] = None) -> List[List[float]]:
+    return _noise_array(width, height, seed).tolist()
 
 
 # =========================
 # Plotting helpers
 # =========================
 
+PLOT_DPI = 80
+
+# Reused across plot_data calls. Built with Figure() rather than pyplot so
+# sandboxed plt.* calls never draw onto it or close it.
+_PLOT_FIG = None
+_PLOT_AX = None
+
+
 def plot_data_series(x: List[float], y: List[float], title: str = "Plot") -> bytes:
+    global _PLOT_FIG, _PLOT_AX
     if plt is None:
         raise RuntimeError("matplotlib is not available for plotting.")
-    fig, ax = plt.subplots()
+    if _PLOT_FIG is None:
+        from matplotlib.figure import Figure
+        _PLOT_FIG = Figure()
+        _PLOT_AX = _PLOT_FIG.add_subplot()
+    ax = _PLOT_AX
+    ax.cla()
     ax.plot(x, y)
     ax.set_title(title)
     ax.set_xlabel("x")
     ax.set_ylabel("y")
     buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
-    buf.seek(0)
-    return buf.read()
+    _PLOT_FIG.savefig(buf, format="png", dpi=PLOT_DPI, bbox_inches="tight")
+    return buf.getvalue()
 
 
 # =========================
@@ -228,32 +464,42 @@ if 'torch' in globals() and torch is not None:
 # Expose our own helpers
 ALLOWED_MODULES["kerr_isco_radius"] = kerr_isco_radius
 ALLOWED_MODULES["gravitational_redshift"] = gravitational_redshift
+if np is not None:
+    ALLOWED_MODULES["redshift_array"] = redshift_array
 ALLOWED_MODULES["sample_orbit_radii"] = sample_orbit_radii
 ALLOWED_MODULES["generate_chaos_parameters"] = generate_chaos_parameters
 ALLOWED_MODULES["generate_noise_field"] = generate_noise_field
 
+# Restricted builtins
+_SAFE_BUILTINS = {
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "len": len,
+    "range": range,
+    "print": print,
+}
+
+# Globals template for exec, built once at import
+_BASE_GLOBALS = {"__builtins__": _SAFE_BUILTINS, **ALLOWED_MODULES}
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_sandboxed(code: str):
+    # Loop-driven clients resend identical code; skip re-parsing it
+    return compile(code, "<string>", "exec")
+
 
 def run_sandboxed_python(code: str) -> Dict[str, Any]:
     """
     Execute Python code in a restricted environment.
     Returns stdout, stderr, and optionally a 'result' variable if defined.
     """
-    # Restricted builtins
-    safe_builtins = {
-        "abs": abs,
-        "min": min,
-        "max": max,
-        "sum": sum,
-        "len": len,
-        "range": range,
-        "print": print,
-    }
-
-    # Globals for exec
-    env_globals = {
-        "__builtins__": safe_builtins,
-    }
-    env_globals.update(ALLOWED_MODULES)
+    # Globals for exec; builtins get their own copy so one run can't
+    # tamper with the next
+    env_globals = _BASE_GLOBALS.copy()
+    env_globals["__builtins__"] = _SAFE_BUILTINS.copy()
 
     # Locals
     env_locals: Dict[str, Any] = {}
@@ -268,7 +514,7 @@ def run_sandboxed_python(code: str) -> Dict[str, Any]:
     sys.stderr = stderr_buf
 
     try:
-        exec(code, env_globals, env_locals)
+        exec(_compile_sandboxed(code), env_globals, env_locals)
     except Exception:
         traceback.print_exc(file=stderr_buf)
     finally:
@@ -311,11 +557,13 @@ def tool_read_file(params: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def tool_list_files(params: Dict[str, Any]) -> Dict[str, Any]:
+    # os.walk yields plain strings from scandir; no Path object per entry
     files = []
-    for p in SANDBOX_ROOT.glob("**/*"):
-        if p.is_file():
-            rel = p.relative_to(SANDBOX_ROOT).as_posix()
-            files.append(rel)
+    root = str(SANDBOX_ROOT)
+    root_len = len(root) + 1
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            files.append(os.path.join(dirpath, name)[root_len:].replace(os.sep, "/"))
     return {"files": files}
 
 
@@ -340,6 +588,13 @@ def tool_run_python(params: Dict[str, Any]) -> Dict[str, Any]:
 def tool_simulate_kerr(params: Dict[str, Any]) -> Dict[str, Any]:
     a = float(params.get("spin", 0.95))
     n = int(params.get("samples", 128))
+    if np is not None:
+        radii_arr = _orbit_radii_array(a, n)
+        return {
+            "spin": a,
+            "radii": radii_arr,
+            "redshifts": redshift_array(radii_arr),
+        }
     radii = sample_orbit_radii(a, n)
     redshifts = [gravitational_redshift(r) for r in radii]
     return {
@@ -355,11 +610,25 @@ def tool_generate_noise(params: Dict[str, Any]) -> Dict[str, Any]:
     seed = params.get("seed", None)
     if seed is not None:
         seed = int(seed)
-    field = generate_noise_field(width, height, seed)
+    encoding = params.get("encoding", "list")
+    if encoding not in ("list", "raw"):
+        raise ValueError("encoding must be 'list' or 'raw'")
+    field = _noise_array(width, height, seed)
+    if encoding == "raw":
+        # Ship the float32 buffer as-is instead of boxing H*W Python floats
+        field_out: Any = {
+            "dtype": "float32",
+            "shape": [height, width],
+            "data_b64": base64.b64encode(field.tobytes()).decode("ascii"),
+        }
+    else:
+        # Serialized straight from the array by send_message
+        field_out = field
     return {
         "width": width,
         "height": height,
-        "field": field,
+        "encoding": encoding,
+        "field": field_out,
     }
 
 
@@ -382,7 +651,10 @@ def tool_plot_data(params: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def tool_chaos_parameters(params: Dict[str, Any]) -> Dict[str, Any]:
-    return generate_chaos_parameters()
+    seed = params.get("seed", None)
+    if seed is not None:
+        seed = int(seed)
+    return generate_chaos_parameters(seed)
 
 
 def tool_gpu_info(params: Dict[str, Any]) -> Dict[str, Any]:
@@ -411,10 +683,10 @@ TOOLS = {
 # MCP-like protocol
 # =========================
 
-def handle_list_tools(request_id: Any) -> None:
-    tools_desc = []
-    for name in TOOLS.keys():
-        tools_desc.append({
+# TOOLS is fixed at import, so the tools/list payload never changes
+_LIST_TOOLS_RESULT = {
+    "tools": [
+        {
             "name": name,
             "description": f"Tool: {name}",
             "inputSchema": {
@@ -422,13 +694,17 @@ def handle_list_tools(request_id: Any) -> None:
                 "properties": {},
                 "additionalProperties": True,
             },
-        })
+        }
+        for name in TOOLS
+    ]
+}
+
+
+def handle_list_tools(request_id: Any) -> None:
     send_message({
         "jsonrpc": "2.0",
         "id": request_id,
-        "result": {
-            "tools": tools_desc
-        }
+        "result": _LIST_TOOLS_RESULT
     })
 
 